@@ -1,30 +1,87 @@
+import functools
+import hashlib
+import io
 import json
 import logging
+import os
+import re
 import sys
 import tempfile
 from argparse import ArgumentParser
-from typing import Tuple, List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, List, Optional
 import boto3
+import numpy as np
 import pandas as pd
 import psycopg2
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.json as pj
+import pyarrow.parquet as pq
 import yaml
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 from yaml.loader import SafeLoader
 from urllib.parse import urlparse
 
 logging.basicConfig(level=logging.INFO)
 
+# Input files are a single {"transactions": [...]} object of flat records
+TRANSACTION_SCHEMA = pa.schema([('customerId', pa.string()), ('customerName', pa.string()),
+                                ('transactionId', pa.string()), ('transactionDate', pa.string()),
+                                ('sourceDate', pa.timestamp('us')), ('merchantId', pa.int64()), ('categoryId', pa.int64()),
+                                ('currency', pa.string()), ('amount', pa.string()), ('description', pa.string())])
+
+# sourceDate is read as a string and parsed as a timestamp once its UTC offset is dropped, PostgreSQL TIMESTAMP columns
+# also ignore the offset and keep the local time
+INPUT_FILE_SCHEMA = TRANSACTION_SCHEMA.set(TRANSACTION_SCHEMA.get_field_index('sourceDate'),
+                                           pa.field('sourceDate', pa.string()))
+SOURCE_DATE_OFFSET = r'(\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)(?:Z|[+-]\d{2}(?::?\d{2})?)$'
+
+# The input file is rewritten as NDJSON in windows of 16MB
+NDJSON_WINDOW_SIZE = 16 * 1024 * 1024
+
+# transactionDates are valid within the datetime64[ns] range, whichever pandas version parses them
+TRANSACTION_DATE_MIN = pd.Timestamp.min.ceil('D')
+TRANSACTION_DATE_MAX = pd.Timestamp.max.floor('D')
+
+# Large S3 files are fetched with parallel ranged GETs of 8MB parts
+S3_TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024,
+                                    max_concurrency=16, use_threads=True)
+
 
 class SnoopTransactions:
     """
     Ingest SnoopTransactions, Perform Data Quality Checks and Upload to PostgreSQL DB
     """
 
-    def __init__(self, file_source: str, file_location: str):
+    def __init__(self, file_source: str, file_location: str, cache_dir: Optional[str] = None):
         self.file_source = file_source
         self.file_location = file_location
+        self.cache_dir = cache_dir
         self.transactions_df = self._create_transactions_df()
-        self._create_postgres_tables()
+        self._conn = self._get_db_connection()
+        try:
+            self._cursor = self._conn.cursor()
+            self._create_postgres_tables()
+        except Exception:
+            # __exit__ is never reached when __init__ fails, so the connection is closed here
+            self._conn.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the PostgreSQL DB connection
+        """
+        self._cursor.close()
+        self._conn.close()
 
     def _create_transactions_df(self) -> pd.DataFrame:
         """
@@ -33,68 +90,288 @@ class SnoopTransactions:
         :return: Dataframe of in the Transactions daa
         """
         if self.file_source == 'local':
-            data = self._extract_local_file()
+            extract_file = self._extract_local_file
 
         elif self.file_source == 's3':
-            data = self._extract_s3_file()
+            extract_file = self._extract_s3_file
         else:
             raise Exception(f"Incorrect Source: {self.file_source}, it must be one of 'local' or 's3")
 
-        df = pd.json_normalize(data['transactions'],
-                               meta=['customerId', 'customerName', 'transactionId', 'transactionDate', 'sourceDate',
-                                     'merchantId', 'categoryId', 'currency', 'amount', 'description'])
-        df.columns = ['customerId', 'customerName', 'transactionId', 'transactionDate', 'sourceDate', 'merchantId',
-                      'categoryId', 'currency', 'amount', 'description']
+        cache_file = self._get_cache_file()
+        df = self._read_cache_file(cache_file) if cache_file is not None else None
+        if df is None:
+            df = extract_file()
+            if cache_file is not None:
+                self._write_cache_file(df, cache_file)
+
+        df['currency'] = df['currency'].astype('category')
         return df
 
-    def _extract_local_file(self) -> Dict:
+    def _get_cache_file(self) -> Optional[str]:
+        """
+        Get the Parquet cache file of the input file, keyed on its location and version (mtime locally, ETag on S3)
+
+        :return: Path of the cache file, None when caching is disabled or the input file can't be found
+        """
+        if self.cache_dir is None:
+            return None
+
+        try:
+            if self.file_source == 'local':
+                version = os.stat(self.file_location).st_mtime_ns
+            else:
+                source_s3_bucket, s3_key = self._split_s3_location()
+                version = boto3.client("s3").head_object(Bucket=source_s3_bucket, Key=s3_key)['ETag']
+        except (IOError, ClientError):
+            return None
+
+        cache_key = hashlib.sha256(f'{self.file_location}:{version}'.encode()).hexdigest()
+        return os.path.join(self.cache_dir, f'{cache_key}.parquet')
+
+    @staticmethod
+    def _read_cache_file(cache_file: str) -> Optional[pd.DataFrame]:
         """
-        Extract the contents of a local file
+        Read the transactions from the Parquet cache file
 
-        :return: input file in a Dict format
+        :param cache_file: Path of the cache file
+        :return: DataFrame of the transaction records, None when the cache file is missing or can't be read
         """
+        if not os.path.exists(cache_file):
+            return None
+
+        logging.info(f'Reading transactions from cache: {cache_file}')
         try:
-            with open(self.file_location) as f:
-                return json.load(f)
+            # Casting back to the transactions schema restores the parsed types
+            table = pq.read_table(cache_file).cast(TRANSACTION_SCHEMA)
+        except (IOError, pa.ArrowException) as error:
+            logging.warning(f'Could not read cache file: {cache_file}, parsing the input file instead. Error: {error}')
+            return None
+
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+    def _write_cache_file(self, df, cache_file: str) -> None:
+        """
+        Write the transactions to the Parquet cache file. The file is written to a temporary file first and then
+        moved into place, so an interrupted write never leaves a truncated cache file behind
+
+        :param df: DataFrame of the transaction records
+        :param cache_file: Path of the cache file
+        """
+        temp_file = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, temp_file = tempfile.mkstemp(dir=self.cache_dir, suffix='.parquet.tmp')
+            os.close(fd)
+            df.to_parquet(temp_file, engine='pyarrow', compression='zstd', index=False)
+            os.replace(temp_file, cache_file)
+        except (IOError, pa.ArrowException) as error:
+            logging.warning(f'Could not write cache file: {cache_file}. Error: {error}')
+        finally:
+            # The temporary file is only left behind when the write failed before it was moved into place
+            if temp_file is not None and os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def _split_s3_location(self) -> Tuple[str, str]:
+        """
+        Split the S3 file location into its bucket and key
+
+        :return: Tuple of the S3 bucket and S3 key
+        """
+        key_split = urlparse(self.file_location, allow_fragments=False)
+        return key_split.netloc, key_split.path.lstrip('/')
+
+    def _parse_transactions(self, data) -> pd.DataFrame:
+        """
+        Parse the transaction records with the pyarrow JSON reader into a pyarrow backed DataFrame.
+        The records are parsed from NDJSON, so the reader splits them into blocks and parses them in parallel
+
+        :param data: bytes-like contents of the input file
+        :return: DataFrame of the transaction records
+        """
+        try:
+            ndjson = self._to_ndjson(data)
+        except ValueError as error:
+            logging.exception(error)
+            raise ValueError(f"Could not parse file: {self.file_location}, {error}")
+
+        try:
+            table = pj.read_json(pa.BufferReader(ndjson),
+                                 parse_options=pj.ParseOptions(explicit_schema=INPUT_FILE_SCHEMA,
+                                                               unexpected_field_behavior='ignore'))
+        except pa.ArrowInvalid as error:
+            # A value of another JSON type than its field fails the whole read, reading the records one by one keeps
+            # those values as strings so the records still go through the DQ Checks
+            logging.warning(f'Could not read file: {self.file_location} with the explicit schema, reading the records '
+                            f'one by one instead. Error: {error}')
+            table = self._parse_records(ndjson)
+
+        source_date = pc.replace_substring_regex(table['sourceDate'], SOURCE_DATE_OFFSET, r'\1')
+        table = table.set_column(table.schema.get_field_index('sourceDate'), 'sourceDate', source_date)
+
+        columns = []
+        for field in TRANSACTION_SCHEMA:
+            try:
+                columns.append(table[field.name].cast(field.type))
+            except pa.ArrowInvalid as error:
+                logging.exception(error)
+                raise ValueError(f"Could not parse file: {self.file_location}, field {field.name} does not match its "
+                                 f"type")
+
+        # pyarrow backed columns store the strings in Arrow buffers instead of as Python objects
+        return pa.Table.from_arrays(columns, schema=TRANSACTION_SCHEMA).to_pandas(types_mapper=pd.ArrowDtype)
+
+    def _parse_records(self, ndjson) -> pa.Table:
+        """
+        Parse the NDJSON transaction records one by one with the json module, every field is read as a string and
+        values of other JSON types are kept as their JSON text
+
+        :param ndjson: Buffer of the NDJSON records
+        :return: Table of the transaction records, with string columns
+        """
+        try:
+            records = [json.loads(line) for line in ndjson.to_pybytes().splitlines() if line.strip()]
+        except ValueError as error:
+            logging.exception(error)
+            raise ValueError(f"Could not parse file: {self.file_location}, {error}")
+
+        return pa.table({name: pa.array([value if value is None or isinstance(value, str) else json.dumps(value)
+                                         for value in (record.get(name) for record in records)], type=pa.string())
+                         for name in INPUT_FILE_SCHEMA.names})
+
+    @staticmethod
+    def _to_ndjson(data) -> pa.Buffer:
+        """
+        Rewrite the {"transactions": [...]} object as NDJSON, one transaction record per line. The records are the
+        values between the first '[' and the last ']', they are split on the commas outside of strings and nested
+        values. The file is scanned in windows, carrying the string and nesting state over from the previous window
+
+        :param data: bytes-like contents of the input file
+        :return: Buffer of the NDJSON records
+        """
+        chars = np.frombuffer(data, dtype=np.uint8)
+
+        start = end = None
+        for offset in range(0, len(chars), NDJSON_WINDOW_SIZE):
+            found = np.flatnonzero(chars[offset:offset + NDJSON_WINDOW_SIZE] == ord('['))
+            if found.size:
+                start = offset + int(found[0]) + 1
+                break
+        for offset in range(len(chars), 0, -NDJSON_WINDOW_SIZE):
+            found = np.flatnonzero(chars[max(offset - NDJSON_WINDOW_SIZE, 0):offset] == ord(']'))
+            if found.size:
+                end = max(offset - NDJSON_WINDOW_SIZE, 0) + int(found[-1])
+                break
+        # Only the transactions list is read, any other key of the object is rejected like a missing one
+        if (start is None or end is None or end < start
+                or not re.fullmatch(rb'\s*\{\s*"transactions"\s*:\s*', chars[:start - 1].tobytes())
+                or not re.fullmatch(rb'\s*}\s*', chars[end + 1:].tobytes())):
+            raise ValueError('expected a {"transactions": [...]} object')
+
+        # Translation tables flagging the characters the records are split on and blanking raw newlines, which can
+        # only be whitespace outside of strings, leaving one record per line
+        classes = bytes(char in b'{}[],"\\' for char in range(256))
+        blanked = bytes(range(256)).replace(b'\n', b' ').replace(b'\r', b' ')
+        nesting = np.zeros(256, dtype=np.int8)
+        nesting[[ord('{'), ord('[')]] = 1
+        nesting[[ord('}'), ord(']')]] = -1
+
+        # Characters are only ever replaced one for one, plus the trailing newline the reader needs at least one byte
+        ndjson = np.empty(end - start + 1, dtype=np.uint8)
+        ndjson[-1] = ord('\n')
+        in_string, backslashes, depth = 0, 0, 0
+        for offset in range(start, end, NDJSON_WINDOW_SIZE):
+            window = chars[offset:min(offset + NDJSON_WINDOW_SIZE, end)]
+            text = window.tobytes()
+            positions = np.flatnonzero(np.frombuffer(text.translate(classes), dtype=np.bool_))
+            kinds = window[positions]
+            quotes = kinds == ord('"')
+
+            # A quote is escaped when it follows an odd run of backslashes, the run can start in the previous window
+            if backslashes or (kinds == ord('\\')).any():
+                last_other = np.maximum.accumulate(np.where(window == ord('\\'), -backslashes - 1,
+                                                            np.arange(len(window))))
+                quote_positions = positions[quotes]
+                run = quote_positions - 1 - np.where(quote_positions > 0, last_other[quote_positions - 1],
+                                                     -backslashes - 1)
+                quotes[np.flatnonzero(quotes)[run % 2 == 1]] = False
+                backslashes = len(window) - 1 - int(last_other[-1])
+
+            # Brackets and commas after an even number of quotes are outside of strings, only the parity of the count
+            # matters so it is allowed to wrap around
+            quote_count = np.cumsum(quotes, dtype=np.uint8)
+            outside = (quote_count + in_string) & 1 == 0
+            depths = depth + np.cumsum(nesting[kinds] * outside, dtype=np.int32)
+
+            lines = ndjson[offset - start:offset - start + len(window)]
+            lines[:] = np.frombuffer(text.translate(blanked), dtype=np.uint8)
+            lines[positions[outside & (kinds == ord(',')) & (depths == 0)]] = ord('\n')
+
+            in_string = (in_string + int(quote_count[-1])) & 1 if len(quote_count) else in_string
+            if len(depths) and depths.min() < 0:
+                raise ValueError('expected a {"transactions": [...]} object')
+            depth = int(depths[-1]) if len(depths) else depth
+
+        # Every string and bracket opened inside the list has to be closed by its end
+        if in_string or depth:
+            raise ValueError('expected a {"transactions": [...]} object')
+
+        return pa.py_buffer(ndjson)
+
+    def _extract_local_file(self) -> pd.DataFrame:
+        """
+        Extract the transaction records of a local file
+
+        :return: DataFrame of the transaction records
+        """
+        try:
+            source = pa.memory_map(self.file_location, 'r')
         except IOError as error:
-            print(error)
+            logging.exception(error)
             raise IOError(f"Could not find local file: {self.file_location}")
 
-    def _extract_s3_file(self) -> Dict:
+        with source:
+            return self._parse_transactions(source.read_buffer())
+
+    def _extract_s3_file(self) -> pd.DataFrame:
         """
-        Extract the contents of a file from S3
+        Extract the transaction records of a file from S3
 
-        :return: input file in a Dict format
+        :return: DataFrame of the transaction records
         """
         logging.info('Downloading file from s3...')
         s3_client = boto3.client("s3")
-        key_split = urlparse(self.file_location, allow_fragments=False)
-        source_s3_bucket = key_split.netloc
-        s3_key = key_split.path.lstrip('/')
+        source_s3_bucket, s3_key = self._split_s3_location()
 
-        with tempfile.TemporaryDirectory() as tmp_directory:
-            tmp_file_location = f"{tmp_directory}/tmp_file.json"
-            try:
-                s3_client.download_file(source_s3_bucket, s3_key,
-                                        tmp_file_location)
-            except ClientError as error:
-                print(error)
-                raise FileNotFoundError(f'S3 file not found, Key: {self.file_location}')
+        buf = io.BytesIO()
+        try:
+            s3_client.download_fileobj(source_s3_bucket, s3_key, buf, Config=S3_TRANSFER_CONFIG)
+        except ClientError as error:
+            logging.exception(error)
+            raise FileNotFoundError(f'S3 file not found, Key: {self.file_location}')
 
-            logging.info('Filed downloaded from s3!!!')
-            with open(tmp_file_location) as f:
-                return json.load(f)
+        logging.info('Filed downloaded from s3!!!')
+        return self._parse_transactions(buf.getbuffer())
 
     def _create_postgres_tables(self) -> None:
         """
         Create the tables in PostgreSQL using .sql files
         """
+        sql_files = ['customers', 'error_logs', 'transactions']
+
+        # Skipping the DDL when all the tables already exist
+        tables = ', '.join(f"('{file}')" for file in sql_files)
+        if self._fetch_sql(f"SELECT bool_and(to_regclass('public.' || t) IS NOT NULL) FROM (VALUES {tables}) v(t)")[0]:
+            logging.info('PostgreSQL tables already exist!!!')
+            return
+
         logging.info('Creating PostgreSQL tables...')
 
-        # Running the DDL SQL Scripts to create the tables
-        sql_files = ['customers', 'error_logs', 'transactions']
+        # Running the DDL SQL Scripts to create the tables in a single round-trip
+        ddl_sql = []
         for file in sql_files:
-            self._execute_sql(open(f"ddl/{file}.sql", "r").read())
+            with open(f"ddl/{file}.sql", "r") as f:
+                ddl_sql.append(f.read())
+        self._execute_sql('\n'.join(ddl_sql))
         logging.info('PostgreSQL tables Created!!!')
 
     def process_file(self) -> None:
@@ -105,7 +382,7 @@ class SnoopTransactions:
 
         self._load_transactions_data(output_df)
         self._load_customers_data(output_df)
-        if len(errors_df.index) > 0:
+        if not errors_df.empty:
             self._load_error_logs_data(errors_df)
 
         if error_messages:
@@ -113,30 +390,41 @@ class SnoopTransactions:
 
     def _run_data_quality_checks(self) -> Tuple[pd.DataFrame, pd.DataFrame, List[str]]:
         """
-        Perform the DQ Checks. Run the de-dup, validate currency column and validate the transactionDate column.
-        Generate the cleaned DataFrame and the errors Data Frame
+        Perform the DQ Checks. Validate the currency column, validate the transactionDate column and run the de-dup
+        on the records that passed validation. Each check produces a boolean mask, the masks are combined and the
+        DataFrame is sliced once into the cleaned DataFrame and the errors Data Frame
 
         :return: Tuple of Cleaned DatFrame, Errors DataFrame and Error Messages
         """
         logging.info('Running DQ Checks...')
 
-        # Validating the currency column
-        df, errors_invalid_cur_df, errors_invalid_cur_message = self._data_validation_currency(self.transactions_df)
+        # Sorting once so the de-dup keeps the latest sourceDate
+        df = self.transactions_df.sort_values('sourceDate', kind='stable')
 
-        # Validating the transactionDate column
-        df, errors_invalid_trans_date_df, errors_invalid_trans_date_message = self._data_validation_transaction_date(df)
+        # Validating the currency and transactionDate columns concurrently, they are independent of each other
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            valid_currency_future = executor.submit(self._data_validation_currency, df)
+            valid_transaction_date_future = executor.submit(self._data_validation_transaction_date, df)
+            valid_currency = valid_currency_future.result()
+            valid_transaction_date = valid_transaction_date_future.result()
 
         # De Duplicating the transaction records
-        df, errors_dedup_df, errors_dedup_message = self._data_deduplicate_transaction(df)
+        duplicate = self._data_deduplicate_transaction(df, valid_currency & valid_transaction_date)
 
-        # Combine all records that failed the DQ checks
-        errors_df = pd.concat([errors_dedup_df, errors_invalid_cur_df, errors_invalid_trans_date_df])
+        # Slice out all records that failed the DQ checks, tagged with the first check they failed
+        valid = valid_currency & valid_transaction_date & ~duplicate
+        errors_df = df[~valid].copy()
+        errors_df['errorReason'] = np.select(
+            [~valid_currency, ~valid_transaction_date, duplicate],
+            ['Invalid Currency', 'Invalid transactionDate', 'Duplicate Record'], default='')[~valid.to_numpy()]
 
         # Combine all the error messages from the DQ checks
-        error_messages = list(filter(None, [errors_dedup_message, errors_invalid_cur_message, errors_invalid_trans_date_message]))
+        error_messages = list(filter(None, ['Duplicate Record(s)' if duplicate.any() else None,
+                                            'Invalid Currency(s)' if not valid_currency.all() else None,
+                                            'Invalid transactionDate(s)' if not valid_transaction_date.all() else None]))
 
         logging.info('DQ Checks Completed!!!')
-        return df, errors_df, error_messages
+        return df[valid], errors_df, error_messages
 
     def _load_customers_data(self, df) -> None:
         """
@@ -145,19 +433,21 @@ class SnoopTransactions:
         :param df: Customers DF to insert
         """
         logging.info('Loading customers data...')
-        df = df.sort_values('transactionDate').drop_duplicates(['customerId'], keep='last')
         df = df[['customerId', 'transactionDate']]
         df = df.rename(columns={'transactionDate': 'transactionDateLatest'})
 
-        query = f"""
+        # The latest transactionDate per customer is picked server side with DISTINCT ON
+        query = """
                     INSERT INTO customers("customerId", "transactionDateLatest")
-                    VALUES {','.join([str(i) for i in list(df.to_records(index=False))])}
+                    SELECT DISTINCT ON ("customerId") "customerId", "transactionDateLatest"
+                    FROM stg_customers
+                    ORDER BY "customerId", "transactionDateLatest" DESC
                     ON CONFLICT ("customerId")
                     DO  UPDATE SET "transactionDateLatest"= EXCLUDED."transactionDateLatest"
                  """
 
-        self._execute_sql(query)
-        self.total_customer_rows = len(df.index)
+        self._copy_and_execute(df, 'customers', query)
+        self.total_customer_rows = df['customerId'].nunique()
         logging.info(f'Customers data loaded to DB!!!')
 
     def _load_transactions_data(self, df) -> None:
@@ -168,18 +458,9 @@ class SnoopTransactions:
         """
         logging.info('Loading transactions data...')
         df['customerName'] = '******'
-        query = f"""
-                    INSERT INTO transactions("customerId", "customerName", "transactionId", "transactionDate", 
-                    "sourceDate", "merchantId", "categoryId", "currency", "amount", "description")
-                    VALUES {','.join([str(i) for i in list(df.to_records(index=False))])}
-                    ON CONFLICT ("customerId", "transactionId")
-                    DO  UPDATE SET "customerName"=EXCLUDED."customerName","transactionDate"=EXCLUDED."transactionDate", 
-                                    "sourceDate"=EXCLUDED."sourceDate", "merchantId"=EXCLUDED."merchantId", 
-                                    "categoryId"=EXCLUDED."categoryId", "currency"=EXCLUDED."currency",
-                                    "amount"=EXCLUDED."amount", "description"=EXCLUDED."description"
-                 """
-
-        self._execute_sql(query)
+        self._copy_upsert(df, 'transactions', conflict_cols=['customerId', 'transactionId'],
+                          update_cols=['customerName', 'transactionDate', 'sourceDate', 'merchantId', 'categoryId',
+                                       'currency', 'amount', 'description'])
         self.total_transactions_rows = len(df.index)
         logging.info(f'Transactions data loaded to DB!!!')
 
@@ -191,13 +472,7 @@ class SnoopTransactions:
         """
         logging.info('Loading error logs data...')
         df['customerName'] = '******'
-        query = f"""
-                    INSERT INTO error_logs("customerId", "customerName", "transactionId", "transactionDate", 
-                    "sourceDate", "merchantId", "categoryId", "currency", "amount", "description", "errorReason")
-                    VALUES {','.join([str(i) for i in list(df.to_records(index=False))])}
-                 """
-
-        self._execute_sql(query)
+        self._copy_upsert(df, 'error_logs')
         self.total_error_logs_rows = len(df.index)
         logging.info(f'Error Logs data loaded to DB, Total Rows!!!')
 
@@ -207,29 +482,101 @@ class SnoopTransactions:
 
         :param sql_query: SQL Query to execute
         """
+        try:
+            self._cursor.execute(sql_query)
+            self._conn.commit()
+        except (Exception, psycopg2.DatabaseError) as error:
+            self._conn.rollback()
+            logging.error('ERROR executing SQL in PostgreSQL DB!')
+            raise error
+
+    def _fetch_sql(self, sql_query) -> tuple:
+        """
+        Execute a SQL Query in PostgresSQL and fetch its first row, ending the transaction so the connection
+        doesn't sit idle in it
+
+        :param sql_query: SQL Query to execute
+        :return: First row of the result
+        """
+        try:
+            self._cursor.execute(sql_query)
+            row = self._cursor.fetchone()
+            self._conn.commit()
+            return row
+        except (Exception, psycopg2.DatabaseError) as error:
+            self._conn.rollback()
+            logging.error('ERROR executing SQL in PostgreSQL DB!')
+            raise error
+
+    def _copy_upsert(self, df, table, conflict_cols=None, update_cols=None) -> None:
+        """
+        Bulk load a DataFrame into the target table through a TEMP staging table.
+        When conflict_cols are given the INSERT uses UPSERT logic, updating update_cols on conflict
+
+        :param df: DataFrame to load, its columns must match the target table columns
+        :param table: Target table name
+        :param conflict_cols: Columns of the target table's unique constraint
+        :param update_cols: Columns to update when a conflicting row already exists
+        """
+        cols = ', '.join(f'"{col}"' for col in df.columns)
+        query = f'INSERT INTO {table}({cols}) SELECT {cols} FROM stg_{table}'
+        if conflict_cols:
+            conflict = ', '.join(f'"{col}"' for col in conflict_cols)
+            updates = ', '.join(f'"{col}"=EXCLUDED."{col}"' for col in update_cols)
+            query += f' ON CONFLICT ({conflict}) DO UPDATE SET {updates}'
+
+        self._copy_and_execute(df, table, query)
+
+    def _copy_and_execute(self, df, table, sql_query) -> None:
+        """
+        COPY a DataFrame into a TEMP staging table named stg_<table>, then execute a SQL Query reading from it.
+        The staging table is dropped when the transaction commits
+
+        :param df: DataFrame to load, its columns must match the target table columns
+        :param table: Target table name, the staging table is created LIKE it
+        :param sql_query: SQL Query to execute once the staging table is loaded
+        """
+        cols = ', '.join(f'"{col}"' for col in df.columns)
+
+        # Arrow's CSV writer serialises the columns natively, writing nulls unquoted and empty strings as "" which
+        # matches the COPY CSV defaults
+        buf = io.BytesIO()
+        pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf,
+                         write_options=pa_csv.WriteOptions(include_header=False))
+        buf.seek(0)
+
+        try:
+            self._cursor.execute(f'CREATE TEMP TABLE stg_{table} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP')
+            self._cursor.copy_expert(f"COPY stg_{table} ({cols}) FROM STDIN WITH CSV", buf)
+            self._cursor.execute(sql_query)
+            self._conn.commit()
+        except (Exception, psycopg2.DatabaseError) as error:
+            self._conn.rollback()
+            logging.error('ERROR executing SQL in PostgreSQL DB!')
+            raise error
+
+    def _get_db_connection(self):
+        """
+        Open a connection to the PostgreSQL DB
+
+        :return: psycopg2 connection
+        """
         POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT, POSTGRES_DATABASE = self._get_db_credentials()
 
-        conn = None
         try:
-            conn = psycopg2.connect(
+            return psycopg2.connect(
                 database=POSTGRES_DATABASE, user=POSTGRES_USER, password=POSTGRES_PASSWORD, host=POSTGRES_HOST,
                 port=POSTGRES_PORT
             )
-
-            with conn.cursor() as cursor:
-                cursor.execute(sql_query)
-            conn.commit()
         except (Exception, psycopg2.DatabaseError) as error:
-            print('ERROR connecting to PostgreSQL DB!')
+            logging.error('ERROR connecting to PostgreSQL DB!')
             raise error
-        finally:
-            if conn is not None:
-                conn.close()
 
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def _get_db_credentials() -> Tuple[str, str, str, str, str]:
         """
-        Get the PostgreSQL DB credentials from config.yaml
+        Get the PostgreSQL DB credentials from config.yaml, the file is only read once per process
 
         :return: Tuple of all the DB Credentials
         """
@@ -241,57 +588,93 @@ class SnoopTransactions:
         return credentials['POSTGRES_USER'], credentials['POSTGRES_PASSWORD'], credentials['POSTGRES_HOST'], credentials['POSTGRES_PORT'], credentials['POSTGRES_DATABASE']
 
     @staticmethod
-    def _data_deduplicate_transaction(df) -> Tuple[pd.DataFrame, pd.DataFrame, str]:
+    def _data_deduplicate_transaction(df, mask) -> pd.Series:
         """
-        Perform De-duplication on the transaction data
+        Perform De-duplication on the transaction data, keeping the last record of each transaction
 
-        :param df: Transaction DataFrame
-        :return: Tuple of Cleaned DatFrame, Errors DataFrame and Error Message
+        :param df: Transaction DataFrame, sorted by sourceDate
+        :param mask: Boolean mask of the records to de-duplicate
+        :return: Boolean mask of the Duplicate records
         """
-        df_dedup = df.sort_values('sourceDate').drop_duplicates(['customerId', 'transactionId'], keep='last')
-
-        df_errors = pd.concat([df, df_dedup]).drop_duplicates(keep=False)
-        df_errors['errorReason'] = 'Duplicate Record'
+        duplicate = df.loc[mask, ['customerId', 'transactionId']].duplicated(keep='last')
 
-        return df_dedup, df_errors, 'Duplicate Record(s)' if len(df_errors) > 0 else None
+        return duplicate.reindex(df.index, fill_value=False)
 
     @staticmethod
-    def _data_validation_currency(df) -> Tuple[pd.DataFrame, pd.DataFrame, str]:
+    def _data_validation_currency(df) -> pd.Series:
         """
         Perform Currency Validation on the transaction data
 
         :param df: Transaction DataFrame
-        :return: Tuple of Cleaned DatFrame, Errors DataFrame and Error Message
+        :return: Boolean mask of the records with a valid currency
         """
         currencies = ['EUR', 'GBP', 'USD']
 
-        df_validation = df.loc[df['currency'].isin(currencies)]
-
-        df_errors = pd.concat([df, df_validation]).drop_duplicates(keep=False)
-        df_errors['errorReason'] = 'Invalid Currency'
+        # Validate the handful of categories once and look the result up by category code, code -1 (NaN) maps to
+        # the trailing False
+        currency = df['currency'].cat
+        valid_categories = np.append(currency.categories.isin(currencies), False)
 
-        return df_validation, df_errors, 'Invalid Currency(s)' if len(df_errors) > 0 else None
+        return pd.Series(valid_categories[currency.codes], index=df.index)
 
     @staticmethod
-    def _data_validation_transaction_date(df) -> Tuple[pd.DataFrame, pd.DataFrame, str]:
+    def _data_validation_transaction_date(df) -> pd.Series:
         """
-        Perform TransactionDate Validation on the transaction data
+        Perform TransactionDate Validation on the transaction data. Dates in the fixed width YYYY-MM-DD form are
+        validated directly on their bytes, any other value falls back to pd.to_datetime
 
         :param df: Transaction DataFrame
-        :return: Tuple of Cleaned DatFrame, Errors DataFrame and Error Message
+        :return: Boolean mask of the records with a valid transactionDate
         """
-        df['transactionDateValidate'] = df['transactionDate']
-        df['transactionDateValidate'] = pd.to_datetime(df['transactionDateValidate'], format='%Y-%m-%d',
-                                                       errors='coerce')
-        df_valid_transaction_date = df.dropna(subset=['transactionDateValidate'])
+        dates = pa.array(df['transactionDate'], type=pa.string())
+        # Columns read back from the Parquet cache come in several chunks
+        if isinstance(dates, pa.ChunkedArray):
+            dates = dates.combine_chunks()
+        fixed_width = pc.fill_null(pc.equal(pc.binary_length(dates), 10), False).to_numpy(zero_copy_only=False)
 
-        df_errors = pd.concat([df, df_valid_transaction_date]).drop_duplicates(keep=False)
+        valid = np.zeros(len(dates), dtype=bool)
+        valid[fixed_width] = SnoopTransactions._valid_iso_dates(pc.filter(dates, fixed_width))
 
-        df_valid_transaction_date = df_valid_transaction_date.drop(columns=['transactionDateValidate'])
-        df_errors = df_errors.drop(columns=['transactionDateValidate'])
-        df_errors['errorReason'] = 'Invalid transactionDate'
+        # Transaction dates repeat heavily, cache=True parses each distinct value once
+        other = ~fixed_width & df['transactionDate'].notna().to_numpy()
+        valid[other] = pd.to_datetime(df.loc[other, 'transactionDate'], format='%Y-%m-%d', errors='coerce',
+                                      cache=True).between(TRANSACTION_DATE_MIN, TRANSACTION_DATE_MAX)
 
-        return df_valid_transaction_date, df_errors, 'Invalid transactionDate(s)' if len(df_errors) > 0 else None
+        return pd.Series(valid, index=df.index)
+
+    @staticmethod
+    def _valid_iso_dates(dates) -> np.ndarray:
+        """
+        Validate 10 byte YYYY-MM-DD strings, checking the digit and dash positions, the day of the month
+        against the calendar and the date against the datetime64[ns] range
+
+        :param dates: pyarrow string array with every value 10 bytes long
+        :return: Boolean array of the valid dates
+        """
+        # Every value is 10 bytes so the data buffer is a contiguous (N, 10) block of characters
+        start = np.frombuffer(dates.buffers()[1], dtype=np.int32)[dates.offset]
+        chars = np.frombuffer(dates.buffers()[2], dtype=np.uint8)[start:start + 10 * len(dates)].reshape(-1, 10)
+        digits = chars.astype(np.int32) - ord('0')
+
+        digit_positions = [0, 1, 2, 3, 5, 6, 8, 9]
+        well_formed = (((digits[:, digit_positions] >= 0) & (digits[:, digit_positions] <= 9)).all(axis=1)
+                       & (chars[:, 4] == ord('-')) & (chars[:, 7] == ord('-')))
+
+        year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+        month = digits[:, 5] * 10 + digits[:, 6]
+        day = digits[:, 8] * 10 + digits[:, 9]
+
+        leap_year = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+        days_in_month = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])[np.clip(month, 0, 12)]
+        days_in_month = days_in_month + (leap_year & (month == 2))
+
+        ordinal = year * 10000 + month * 100 + day
+        in_range = ((ordinal >= TRANSACTION_DATE_MIN.year * 10000 + TRANSACTION_DATE_MIN.month * 100
+                     + TRANSACTION_DATE_MIN.day)
+                    & (ordinal <= TRANSACTION_DATE_MAX.year * 10000 + TRANSACTION_DATE_MAX.month * 100
+                       + TRANSACTION_DATE_MAX.day))
+
+        return well_formed & in_range & (month >= 1) & (month <= 12) & (day >= 1) & (day <= days_in_month)
 
 
 if __name__ == "__main__":
@@ -306,8 +689,13 @@ if __name__ == "__main__":
         nargs="?",
         help="File path of the location of the file: local path or full s3 key",
     )
-    args = parser.parse_args()
-    transactions = SnoopTransactions(args.file_source, args.file_location)
-    sys.exit(
-        transactions.process_file()
+    parser.add_argument(
+        "--cache_dir",
+        nargs="?",
+        help="Optional directory to cache the parsed file in as Parquet, reused while the file is unchanged",
     )
+    args = parser.parse_args()
+    with SnoopTransactions(args.file_source, args.file_location, args.cache_dir) as transactions:
+        sys.exit(
+            transactions.process_file()
+        )
@@ -1,8 +1,12 @@
+import json
+import re
 import pytest
 from moto import mock_s3
 from snoop_program import SnoopTransactions
 from mock import patch
 import boto3
+import pandas as pd
+import pyarrow as pa
 
 POSTGRES_CREDENTILS = {
     'POSTGRES_HOST': 'hosting',
@@ -13,6 +17,14 @@ POSTGRES_CREDENTILS = {
 }
 
 
+@pytest.fixture(autouse=True)
+def clear_db_credentials_cache():
+    """The DB credentials are cached per process, clearing them so each test reads its own patched config"""
+    SnoopTransactions._get_db_credentials.cache_clear()
+    yield
+    SnoopTransactions._get_db_credentials.cache_clear()
+
+
 @patch('psycopg2.connect')
 @patch("yaml.load")
 def test_end_to_end_local_dq_pass(mock_yaml_load, mock_connect):
@@ -23,6 +35,7 @@ def test_end_to_end_local_dq_pass(mock_yaml_load, mock_connect):
 
     assert snoop_transactions_local.total_transactions_rows == 3
     assert snoop_transactions_local.total_customer_rows == 3
+    mock_connect.assert_called_once()
 
 
 @mock_s3
@@ -60,6 +73,13 @@ def test_end_to_end_local_dq_fail(mock_yaml_load, mock_connect):
         assert snoop_transactions_local.total_transactions_rows == 6
         assert snoop_transactions_local.total_customer_rows == 2
 
+    # The failed records are bulk loaded into error_logs through the COPY staging table
+    copied_sql = [call.args[0] for call in mock_connect.return_value.cursor.return_value.copy_expert.call_args_list]
+    assert 'COPY stg_error_logs ("customerId", "customerName", "transactionId", "transactionDate", "sourceDate", ' \
+           '"merchantId", "categoryId", "currency", "amount", "description", "errorReason") FROM STDIN WITH CSV' \
+           in copied_sql
+    assert snoop_transactions_local.total_error_logs_rows == 6
+
 
 @patch('psycopg2.connect')
 @patch("yaml.load")
@@ -103,3 +123,266 @@ def test_invalid_file_location_s3(mock_yaml_load, mock_connect):
     with pytest.raises(FileNotFoundError, match=error_message):
         snoop_transactions_local = SnoopTransactions('s3', 's3://test-bucket/path/to/incorrect_file.json')
         snoop_transactions_local.process_file()
+
+
+@pytest.mark.parametrize('tables_exist, ddl_calls', [(True, 0), (False, 1)])
+@patch('psycopg2.connect')
+@patch("yaml.load")
+def test_create_postgres_tables(mock_yaml_load, mock_connect, tables_exist, ddl_calls):
+    """The DDL SQL Scripts only run when the tables do not exist yet"""
+    mock_yaml_load.return_value = POSTGRES_CREDENTILS
+    mock_cursor = mock_connect.return_value.cursor.return_value
+    mock_cursor.fetchone.return_value = (tables_exist,)
+
+    SnoopTransactions('local', 'test/resources/test_data_dq_pass.json')
+
+    executed_sql = [call.args[0] for call in mock_cursor.execute.call_args_list]
+    assert len([sql for sql in executed_sql if 'CREATE TABLE' in sql]) == ddl_calls
+    assert mock_connect.return_value.commit.call_count == 1 + ddl_calls
+
+
+@patch('psycopg2.connect')
+@patch("yaml.load")
+def test_create_postgres_tables_failure(mock_yaml_load, mock_connect):
+    """The DB connection is closed when creating the tables fails"""
+    mock_yaml_load.return_value = POSTGRES_CREDENTILS
+    mock_connect.return_value.cursor.return_value.execute.side_effect = Exception('DDL failed')
+
+    with pytest.raises(Exception, match='DDL failed'):
+        SnoopTransactions('local', 'test/resources/test_data_dq_pass.json')
+
+    mock_connect.return_value.close.assert_called_once()
+
+
+@patch('psycopg2.connect')
+@patch("yaml.load")
+def test_transactions_parquet_cache(mock_yaml_load, mock_connect, tmp_path):
+    """The parsed file is cached as Parquet and read back from the cache while the file is unchanged"""
+    mock_yaml_load.return_value = POSTGRES_CREDENTILS
+    snoop_transactions_parsed = SnoopTransactions('local', 'test/resources/test_data_dq_errors.json', str(tmp_path))
+    assert len(list(tmp_path.glob('*.parquet'))) == 1
+
+    with patch.object(SnoopTransactions, '_extract_local_file') as mock_extract_local_file:
+        snoop_transactions_cached = SnoopTransactions('local', 'test/resources/test_data_dq_errors.json',
+                                                      str(tmp_path))
+
+    mock_extract_local_file.assert_not_called()
+    pd.testing.assert_frame_equal(snoop_transactions_cached.transactions_df, snoop_transactions_parsed.transactions_df)
+
+
+@patch('psycopg2.connect')
+@patch("yaml.load")
+def test_transactions_parquet_cache_unreadable(mock_yaml_load, mock_connect, tmp_path):
+    """A truncated cache file is treated as a cache miss and replaced"""
+    mock_yaml_load.return_value = POSTGRES_CREDENTILS
+    snoop_transactions_parsed = SnoopTransactions('local', 'test/resources/test_data_dq_errors.json', str(tmp_path))
+    cache_file, = tmp_path.glob('*.parquet')
+    cache_file.write_bytes(cache_file.read_bytes()[:100])
+
+    snoop_transactions_reparsed = SnoopTransactions('local', 'test/resources/test_data_dq_errors.json',
+                                                    str(tmp_path))
+
+    pd.testing.assert_frame_equal(snoop_transactions_reparsed.transactions_df,
+                                  snoop_transactions_parsed.transactions_df)
+    assert [path.name for path in tmp_path.iterdir()] == [cache_file.name]
+    assert cache_file.stat().st_size > 100
+
+
+@pytest.mark.parametrize('error', [OSError('No space left on device'), RuntimeError('Interrupted')])
+@patch('psycopg2.connect')
+@patch("yaml.load")
+def test_transactions_parquet_cache_write_failure(mock_yaml_load, mock_connect, tmp_path, error):
+    """No temporary file is left behind when writing the cache file fails, only write errors are logged"""
+    mock_yaml_load.return_value = POSTGRES_CREDENTILS
+
+    def to_parquet(path, **kwargs):
+        with open(path, 'wb') as f:
+            f.write(b'PAR1')
+        raise error
+
+    with patch.object(pd.DataFrame, 'to_parquet', side_effect=to_parquet):
+        if isinstance(error, OSError):
+            SnoopTransactions('local', 'test/resources/test_data_dq_errors.json', str(tmp_path))
+        else:
+            with pytest.raises(RuntimeError, match='Interrupted'):
+                SnoopTransactions('local', 'test/resources/test_data_dq_errors.json', str(tmp_path))
+
+    assert list(tmp_path.iterdir()) == []
+
+
+@patch('psycopg2.connect')
+@patch("yaml.load")
+def test_transactions_parquet_cache_unusable_dir(mock_yaml_load, mock_connect, tmp_path):
+    """An unusable cache directory only disables the cache"""
+    mock_yaml_load.return_value = POSTGRES_CREDENTILS
+    not_a_dir = tmp_path / 'file'
+    not_a_dir.write_text('')
+
+    snoop_transactions_local = SnoopTransactions('local', 'test/resources/test_data_dq_errors.json',
+                                                 str(not_a_dir / 'cache'))
+
+    assert len(snoop_transactions_local.transactions_df.index) == 10
+    assert [path.name for path in tmp_path.iterdir()] == ['file']
+
+
+@patch('psycopg2.connect')
+@patch("yaml.load")
+def test_data_quality_checks_errors(mock_yaml_load, mock_connect):
+    """Records failing the DQ Checks are split out once, tagged with the first check they failed"""
+    mock_yaml_load.return_value = POSTGRES_CREDENTILS
+    snoop_transactions_local = SnoopTransactions('local', 'test/resources/test_data_dq_errors.json')
+    output_df, errors_df, error_messages = snoop_transactions_local._run_data_quality_checks()
+
+    assert len(output_df.index) == 4
+    assert errors_df['errorReason'].value_counts().to_dict() == {
+        'Duplicate Record': 3,
+        'Invalid Currency': 2,
+        'Invalid transactionDate': 1
+    }
+    assert set(output_df.index).isdisjoint(errors_df.index)
+    assert error_messages == ['Duplicate Record(s)', 'Invalid Currency(s)', 'Invalid transactionDate(s)']
+
+
+@pytest.mark.parametrize('transaction_date, valid', [
+    ('2022-02-28', True),
+    ('2024-02-29', True),
+    ('2000-02-29', True),
+    ('2022-02-29', False),
+    ('1900-02-29', False),
+    ('2022-04-31', False),
+    ('2022-13-01', False),
+    ('2022-00-10', False),
+    ('0000-01-01', False),
+    ('0001-01-01', False),
+    ('1600-01-01', False),
+    ('1600-1-1', False),
+    ('2300-01-01', False),
+    ('2300-1-1', False),
+    ('1677-09-21', False),
+    ('1677-9-21', False),
+    ('1677-09-22', True),
+    ('1677-9-22', True),
+    ('2262-04-11', True),
+    ('2262-4-11', True),
+    ('2262-04-12', False),
+    ('2262-4-12', False),
+    ('2022/02/01', False),
+    ('2022-2-1', True),
+    (' 2022-02-01', False),
+    ('yeash', False),
+    (None, False),
+])
+def test_data_validation_transaction_date(transaction_date, valid):
+    """TransactionDate Validation of fixed width and other values"""
+    df = pd.DataFrame({'transactionDate': pd.array([transaction_date], dtype=pd.ArrowDtype(pa.string()))})
+
+    assert SnoopTransactions._data_validation_transaction_date(df).tolist() == [valid]
+
+
+@pytest.mark.parametrize('window_size', [1, 7, 16 * 1024 * 1024])
+def test_to_ndjson(window_size):
+    """The transaction records are rewritten one per line, whatever the strings contain or the window size"""
+    records = [
+        {'customerId': 'a', 'description': 'braces {}, brackets [], commas , and newlines \n'},
+        {'customerId': 'b', 'description': 'escaped quote \" and backslashes \\\\", {"customerId": "c"}'},
+        {'customerId': 'c', 'description': ['nested', {'values': [1, 2]}]}
+    ]
+    data = json.dumps({'transactions': records}, indent=4).encode()
+
+    with patch('snoop_program.NDJSON_WINDOW_SIZE', window_size):
+        ndjson = SnoopTransactions._to_ndjson(data).to_pybytes().decode()
+
+    assert [json.loads(line) for line in ndjson.splitlines() if line.strip()] == records
+
+
+@pytest.mark.parametrize('field, value, parsed, clean_rows, error_reasons', [
+    ('transactionDate', 20220101, '20220101', 2, {'Invalid transactionDate': 1}),
+    ('currency', 1, '1', 2, {'Invalid Currency': 1}),
+    ('amount', 999.99, '999.99', 3, {}),
+    ('merchantId', '36', 36, 3, {}),
+])
+@patch('psycopg2.connect')
+@patch("yaml.load")
+def test_parse_transactions_type_mismatch(mock_yaml_load, mock_connect, tmp_path, field, value, parsed, clean_rows,
+                                          error_reasons):
+    """Records with a field of another JSON type are still read and go through the DQ Checks"""
+    mock_yaml_load.return_value = POSTGRES_CREDENTILS
+    with open('test/resources/test_data_dq_pass.json') as f:
+        data = json.load(f)
+    data['transactions'][1][field] = value
+    file_location = tmp_path / 'transactions.json'
+    file_location.write_text(json.dumps(data))
+
+    snoop_transactions_local = SnoopTransactions('local', str(file_location))
+    output_df, errors_df, error_messages = snoop_transactions_local._run_data_quality_checks()
+
+    assert snoop_transactions_local.transactions_df[field].iloc[1] == parsed
+    assert len(output_df.index) == clean_rows
+    assert errors_df['errorReason'].value_counts().to_dict() == error_reasons
+
+
+@patch('psycopg2.connect')
+@patch("yaml.load")
+def test_parse_transactions_invalid_value(mock_yaml_load, mock_connect, tmp_path):
+    """Raising an Exception naming the file and the field when a value can't be converted to its field's type"""
+    mock_yaml_load.return_value = POSTGRES_CREDENTILS
+    with open('test/resources/test_data_dq_pass.json') as f:
+        data = json.load(f)
+    data['transactions'][1]['merchantId'] = 'abc'
+    file_location = tmp_path / 'transactions.json'
+    file_location.write_text(json.dumps(data))
+    error_message = re.escape(f'Could not parse file: {file_location}, field merchantId does not match its type')
+
+    with pytest.raises(ValueError, match=error_message):
+        SnoopTransactions('local', str(file_location))
+
+
+@pytest.mark.parametrize('data', [
+    {'notransactions': [{'customerId': 'a'}]},
+    {'other': [1, 2], 'transactions': [{'customerId': 'a'}]},
+    {'transactions': [{'customerId': 'a'}], 'other': [1, 2]},
+    {'transactions': [{'customerId': 'a'}], 'other': {'values': '[]'}},
+])
+@patch('psycopg2.connect')
+@patch("yaml.load")
+def test_parse_transactions_invalid_envelope(mock_yaml_load, mock_connect, tmp_path, data):
+    """Raising an Exception when the file is not a single {"transactions": [...]} object"""
+    mock_yaml_load.return_value = POSTGRES_CREDENTILS
+    file_location = tmp_path / 'transactions.json'
+    file_location.write_text(json.dumps(data))
+    error_message = re.escape(f'Could not parse file: {file_location}, expected a {{"transactions": [...]}} object')
+
+    with pytest.raises(ValueError, match=error_message):
+        SnoopTransactions('local', str(file_location))
+
+
+@pytest.mark.parametrize('source_date, parsed', [
+    ('2022-02-22T21:20:48', '2022-02-22 21:20:48'),
+    ('2022-02-22T21:20:48.123', '2022-02-22 21:20:48.123'),
+    ('2022-02-22T21:20:48.123456', '2022-02-22 21:20:48.123456'),
+    ('2022-02-22T21:20:48+01:00', '2022-02-22 21:20:48'),
+    ('2022-02-22T21:20:48.5-0500', '2022-02-22 21:20:48.5'),
+    ('2022-02-22T21:20:48Z', '2022-02-22 21:20:48'),
+])
+@patch('psycopg2.connect')
+@patch("yaml.load")
+def test_parse_transactions_source_date(mock_yaml_load, mock_connect, tmp_path, source_date, parsed):
+    """sourceDate keeps its fractional seconds and its local time, dropping any UTC offset"""
+    mock_yaml_load.return_value = POSTGRES_CREDENTILS
+    with open('test/resources/test_data_dq_pass.json') as f:
+        data = json.load(f)
+    data['transactions'][0]['sourceDate'] = source_date
+    file_location = tmp_path / 'transactions.json'
+    file_location.write_text(json.dumps(data))
+
+    snoop_transactions_local = SnoopTransactions('local', str(file_location))
+
+    assert snoop_transactions_local.transactions_df['sourceDate'].iloc[0] == pd.Timestamp(parsed)
+
+
+def test_data_validation_transaction_date_chunked():
+    """TransactionDate Validation of a column made of several Arrow chunks"""
+    dates = pa.chunked_array([['2022-02-28', 'yeash'], ['2022-02-29', None, '2024-02-29']], type=pa.string())
+    df = pd.DataFrame({'transactionDate': pd.arrays.ArrowExtensionArray(dates)})
+
+    assert SnoopTransactions._data_validation_transaction_date(df).tolist() == [True, False, False, False, True]